@@ -0,0 +1,376 @@
+import re
+import numpy as np
+import fitz  # PyMuPDF
+import cv2
+
+from recognition_cache import recognition_cache, crop_hash
+
+# High DPI: Scale 6.0 ~ 432 DPI (Extra detail for distinguishing similar numbers)
+OCR_ZOOM = 6.0
+
+# How many similar-sized crops go through the detector together in multi-region mode
+OCR_BATCH_SIZE = 8
+# EasyOCR's detector canvas; larger images are scaled down before detection
+DETECTOR_CANVAS = 2560
+# Padded pixels per batch, so a batch never costs more than one full-canvas image
+OCR_BATCH_MAX_PIXELS = DETECTOR_CANVAS * DETECTOR_CANVAS
+# Padding may add at most this fraction to a batch's pixels; crops that
+# would need more go through on their own
+OCR_BATCH_MAX_PADDING = 0.1
+
+ALLOWLIST_CHARS = '0123456789()[]{}-"\' .kKlIOoSsZzBWwxX|'
+
+# Typo Correction Map
+CHAR_MAP = {
+    'k': '1', 'K': '1', 'l': '1', 'I': '1', '|': '1',
+    'O': '0', 'o': '0', 'D': '0', 'Q': '0',
+    'S': '5', 's': '5',
+    'Z': '2', 'z': '2',
+    'B': '8',
+    '{': '(', '}': ')',
+    # STRICT CHANGE: Unmap [] so they are NOT converted to ()
+    # '[': '(', ']': ')'
+}
+
+# Regexes
+REGEX_BEAM = re.compile(r'([Ww]\d+[xX]\d+)', re.IGNORECASE)
+REGEX_BRACKET = re.compile(r'\[\s*(\d+)\s*\]')  # Strict Square Brackets
+
+# Linking threshold: How far can a label be?
+# At 6.0 scale, text is large. Let's say ~300-400px is reasonable for "associated"
+# but sometimes it's far. Let's try 1500px diagonal max (generous but keeps locality).
+MAX_DIST = 1500
+
+
+def normalize_text(text):
+    """Apply the OCR typo correction map character by character."""
+    return "".join(CHAR_MAP.get(char, char) for char in text)
+
+
+def rasterize_gray(page, rect, zoom=OCR_ZOOM):
+    """Render a clip of the page straight to a grayscale numpy array."""
+    pix = page.get_pixmap(clip=rect, matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+
+
+def crop_from_raster(raster, raster_rect, rect, zoom=OCR_ZOOM):
+    """Slice the pixels of `rect` out of a raster rendered for `raster_rect`.
+
+    Both rects are in page coordinates; the offsets match what
+    `page.get_pixmap(clip=rect)` would have produced on its own.
+    """
+    origin = (fitz.Rect(raster_rect) * fitz.Matrix(zoom, zoom)).irect
+    target = (fitz.Rect(rect) * fitz.Matrix(zoom, zoom)).irect
+    x0, y0 = target.x0 - origin.x0, target.y0 - origin.y0
+    return raster[max(y0, 0):y0 + target.height, max(x0, 0):x0 + target.width]
+
+
+def preprocess(gray):
+    """Build the image variants fed to the OCR passes."""
+    # 1. Sharpening Filter (helps define edges for digits like 2, 3, 5, 6)
+    kernel_sharpen = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+    img_sharpened = cv2.filter2D(gray, -1, kernel_sharpen)
+
+    # 2. Adaptive Thresholding (use sharpened image)
+    # Block Size: 21 (Larger block for smoother background), C: 4
+    img_adaptive = cv2.adaptiveThreshold(
+        img_sharpened, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 21, 4
+    )
+
+    # 3. Light Dilation (Helps with thin/faint lines)
+    img_inv = cv2.bitwise_not(img_adaptive)
+    img_dilated = cv2.dilate(img_inv, np.ones((2,2), np.uint8), iterations=1)
+    img_final = cv2.bitwise_not(img_dilated)
+
+    # Debug: Save processed image if needed (uncomment for local debug)
+    # cv2.imwrite("debug_ocr_input.png", img_adaptive)
+
+    return img_sharpened, img_adaptive, img_final
+
+
+def map_bbox(bbox, rotation, w, h):
+    """Map a bbox found on a rotated image back onto the unrotated one."""
+    new_bbox = []
+    for [x, y] in bbox:
+        if rotation == 90:
+            new_bbox.append([y, h - x])
+        elif rotation == 270:
+            new_bbox.append([w - y, x])
+        else:
+            new_bbox.append([x, y])
+    return new_bbox
+
+
+def _pad_to(img, h, w):
+    # White padding on the bottom/right keeps bbox coordinates unchanged
+    if img.shape == (h, w):
+        return img
+    return cv2.copyMakeBorder(img, 0, h - img.shape[0], 0, w - img.shape[1],
+                              cv2.BORDER_CONSTANT, value=255)
+
+
+def _box_points(x_min, x_max, y_min, y_max):
+    return [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+
+
+def _recognize_cached(reader, gray, boxes):
+    # Axis-aligned boxes from the detector: [x_min, x_max, y_min, y_max]
+    h, w = gray.shape
+    results = []
+    misses = {}
+    for box in boxes:
+        # Same clipping EasyOCR applies before cropping
+        x_min, x_max = max(0, int(box[0])), min(int(box[1]), w)
+        y_min, y_max = max(0, int(box[2])), min(int(box[3]), h)
+        key = crop_hash(gray[y_min:y_max, x_min:x_max], ALLOWLIST_CHARS)
+        cached = recognition_cache.get(key) if key else None
+        if cached is None:
+            misses.setdefault((x_min, y_min, x_max, y_max), []).append((box, key))
+        elif cached[0] is not None:
+            results.append((_box_points(x_min, x_max, y_min, y_max), cached[0], cached[1]))
+
+    if misses:
+        miss_boxes = [box for entries in misses.values() for box, _ in entries]
+        recognized = {}
+        for (bbox, text, conf) in reader.recognize(gray, horizontal_list=miss_boxes, free_list=[],
+                                                   allowlist=ALLOWLIST_CHARS, detail=1):
+            recognized[(int(bbox[0][0]), int(bbox[0][1]), int(bbox[2][0]), int(bbox[2][1]))] = (bbox, text, conf)
+        recognized_items = []
+        for coords, entries in misses.items():
+            found = recognized.get(coords)
+            for _, key in entries:
+                if key:
+                    recognized_items.append((key, found[1] if found else None, found[2] if found else 0.0))
+            if found:
+                results.extend([found] * len(entries))
+        recognition_cache.put_many(recognized_items)
+    return results
+
+
+def _readtext_cached(reader, images):
+    # Detect on the whole batch, then recognize only crops not seen before.
+    # Batches come padded to one shape within group_crops' pixel budget.
+    batch = np.stack([cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) for img in images])
+    horizontal_lists, free_lists = reader.detect(batch, reformat=False)
+    batch_res = []
+    for img, horizontal, free in zip(images, horizontal_lists, free_lists):
+        res = _recognize_cached(reader, img, horizontal)
+        if free:
+            # Skewed boxes are rare on these sheets; recognize them uncached
+            res.extend(reader.recognize(img, horizontal_list=[], free_list=free,
+                                        allowlist=ALLOWLIST_CHARS, detail=1))
+        batch_res.append(res)
+    return batch_res
+
+
+def _readtext(reader, images):
+    if recognition_cache.enabled and hasattr(reader, "detect"):
+        return _readtext_cached(reader, images)
+    if len(images) == 1:
+        return [reader.readtext(images[0], allowlist=ALLOWLIST_CHARS, detail=1)]
+    return reader.readtext_batched(images, allowlist=ALLOWLIST_CHARS, detail=1)
+
+
+def _ocr_batch(reader, variants, check_cancelled):
+    # All variants in the batch share one shape (see run_ocr_passes)
+    h, w = variants[0][0].shape
+    results = [[] for _ in variants]
+
+    def run_pass(images, rotation=0):
+        check_cancelled()
+        for res, out in zip(_readtext(reader, images), results):
+            out.extend((map_bbox(b, rotation, w, h), t, c) for (b, t, c) in res)
+
+    # Pass 1: Sharpened Grayscale (Clean native look)
+    run_pass([v[0] for v in variants])
+    # Pass 2: Adaptive Threshold (Binarized look)
+    run_pass([v[1] for v in variants])
+    # Pass 3: Light Dilation
+    run_pass([v[2] for v in variants])
+
+    # Pass 4 & 5: Rotated (Helps with vertical text)
+    run_pass([cv2.rotate(v[2], cv2.ROTATE_90_CLOCKWISE) for v in variants], 90)
+    run_pass([cv2.rotate(v[2], cv2.ROTATE_90_COUNTERCLOCKWISE) for v in variants], 270)
+    return results
+
+
+def group_crops(shapes):
+    """Split crops into detector batches by their (h, w) shapes.
+
+    Crops are taken in size order and added to the current batch while the
+    padded batch stays within OCR_BATCH_SIZE, OCR_BATCH_MAX_PIXELS and
+    OCR_BATCH_MAX_PADDING and fits the detector canvas unscaled. Returns
+    a list of index lists; a crop that fits with no other is alone.
+    """
+    groups = []
+    group, h, w, area = [], 0, 0, 0
+    for i in sorted(range(len(shapes)), key=lambda i: shapes[i]):
+        ch, cw = shapes[i]
+        nh, nw = max(h, ch), max(w, cw)
+        padded = nh * nw * (len(group) + 1)
+        if group and (len(group) == OCR_BATCH_SIZE
+                      or padded > OCR_BATCH_MAX_PIXELS
+                      or padded > (1 + OCR_BATCH_MAX_PADDING) * (area + ch * cw)
+                      or max(nh, nw) > DETECTOR_CANVAS):
+            groups.append(group)
+            group, nh, nw, area = [], ch, cw, 0
+        group.append(i)
+        h, w, area = nh, nw, area + ch * cw
+    if group:
+        groups.append(group)
+    return groups
+
+
+def run_ocr_passes(reader, grays, check_cancelled=None, variants=None):
+    """Run all five OCR passes over each grayscale crop.
+
+    Crops of similar size are grouped (see group_crops) and padded so that
+    each group goes through the detector as one batch. `check_cancelled` is called before every
+    pass and may raise to abandon the work. `variants` may hold the
+    already preprocessed (sharpened, adaptive, final) images per crop.
+    Returns one list of (bbox, text, conf) per input crop, in input order.
+    """
+    check_cancelled = check_cancelled or (lambda: None)
+    if variants is None:
+        variants = [preprocess(g) for g in grays]
+    results = [None] * len(grays)
+    for idx in group_crops([g.shape for g in grays]):
+        h = max(grays[i].shape[0] for i in idx)
+        w = max(grays[i].shape[1] for i in idx)
+        batch = [tuple(_pad_to(v, h, w) for v in variants[i]) for i in idx]
+        for i, res in zip(idx, _ocr_batch(reader, batch, check_cancelled)):
+            results[i] = res
+    return results
+
+
+def log_unique_results(all_ocr_results):
+    """Print each distinct OCR result once (debug aid)."""
+    extracted_texts = []
+    seen_results = []
+
+    for (bbox, text_val, conf) in all_ocr_results:
+        clean_t = text_val.strip()
+        if len(clean_t) < 1: continue
+
+        # 1. Apply Character Mapping
+        norm_t = normalize_text(clean_t)
+
+        # 2. Normalize Spacing (remove all spaces for de-duplication)
+        dedupe_key = re.sub(r'\s+', '', norm_t)
+
+        cx = sum(p[0] for p in bbox) / 4
+        cy = sum(p[1] for p in bbox) / 4
+
+        is_dupe = False
+        for (s_key, s_cx, s_cy) in seen_results:
+            if s_key == dedupe_key:
+                dist = ((cx - s_cx)**2 + (cy - s_cy)**2)**0.5
+                if dist < 20:
+                    is_dupe = True
+                    break
+
+        if not is_dupe:
+            print(f"DEBUG - New OCR Result: '{clean_t}' -> '{norm_t}' at ({cx:.1f}, {cy:.1f})")
+            seen_results.append((dedupe_key, cx, cy))
+            extracted_texts.append(norm_t)
+
+    return extracted_texts
+
+
+def spatial_extract(all_ocr_results):
+    """Link bracketed stud counts to their nearest beam label.
+
+    Returns the `/api/extract-text` response body.
+    """
+    beams = []
+    candidates = []
+
+    for (bbox, text_val, conf) in all_ocr_results:
+        clean_t = text_val.strip()
+
+        # fix common typos in clean_t before regex
+        # e.g. 'W12x14' often read as 'W12x14' (correct) but sometimes 'W12x1A'
+        # For now, rely on strict regex, but normalize spaces
+        clean_t_nospace = re.sub(r'\s+', '', clean_t)
+
+        # Check for Beam Label
+        beam_match = REGEX_BEAM.search(clean_t_nospace)
+        if beam_match:
+            # Calculate Centroid
+            cx = sum(p[0] for p in bbox) / 4
+            cy = sum(p[1] for p in bbox) / 4
+            label = beam_match.group(1).upper()
+            beams.append({'label': label, 'cx': cx, 'cy': cy, 'bbox': bbox})
+            continue # Don't double count as a candidate
+
+        # Check for Square Bracket Value
+        # We use the spaced 'clean_t' here to allow '[ 12 ]'
+        # and apply the char map to fix 'l' -> '1', 'O' -> '0' inside brackets
+        mapped_t = normalize_text(clean_t)
+
+        brack_match = REGEX_BRACKET.search(mapped_t)
+        if brack_match:
+            val = int(brack_match.group(1))
+            if 6 <= val <= 60: # Strict Range
+                cx = sum(p[0] for p in bbox) / 4
+                cy = sum(p[1] for p in bbox) / 4
+                candidates.append({'val': val, 'cx': cx, 'cy': cy})
+
+    # Linking Phase
+    # For each candidate, find the NEAREST beam label.
+    studs = []
+    profiles = {}
+    total_studs = 0
+    sum_bracketed_values = 0
+
+    for cand in candidates:
+        best_beam = None
+        min_dist = float('inf')
+
+        for beam in beams:
+            dist = ((cand['cx'] - beam['cx'])**2 + (cand['cy'] - beam['cy'])**2)**0.5
+            if dist < min_dist:
+                min_dist = dist
+                best_beam = beam
+
+        if best_beam and min_dist <= MAX_DIST:
+            # Associated!
+            b_label = best_beam['label']
+            val = cand['val']
+
+            print(f"✅ Linked [{val}] to {b_label} (dist: {min_dist:.1f})")
+
+            studs.append(val)
+            total_studs += 1
+            sum_bracketed_values += val
+
+            if b_label not in profiles:
+                profiles[b_label] = []
+            profiles[b_label].append(val)
+        else:
+            print(f"⚠️ Ignored Isolated [{cand['val']}] - Nearest Beam dist: {min_dist:.1f}")
+
+    print(f"DEBUG - Final Spatial Profiles: {profiles.keys()}")
+
+    return {
+        "success": True,
+        "elevations": [], # (Legacy, mostly empty now)
+        "studs": studs,
+        "profiles": profiles,
+        "studs_total": sum_bracketed_values,
+        "studs_count": total_studs,
+        "raw_text": "" # No longer relevant in spatial mode
+    }
+
+
+def combine_results(results):
+    """Merge per-region extraction results into project-level totals."""
+    profiles = {}
+    for res in results:
+        for label, vals in res["profiles"].items():
+            profiles.setdefault(label, []).extend(vals)
+    return {
+        "profiles": profiles,
+        "studs_total": sum(res["studs_total"] for res in results),
+        "studs_count": sum(res["studs_count"] for res in results),
+    }
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import uuid
+
+
+class ExtractionCancelled(Exception):
+    pass
+
+
+class Job:
+    """Cancellation flag for one extraction request.
+
+    The OCR worker calls `check()` between passes and batches, so a
+    cancelled job stops at the next one and frees its thread.
+    """
+
+    def __init__(self, job_id, session_id=None):
+        self.job_id = job_id
+        self.session_id = session_id
+        self.cancelled = threading.Event()
+        self.done = False
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise ExtractionCancelled(self.job_id)
+
+
+# job_id -> Job, and session_id -> its latest job_id
+jobs = {}
+session_jobs = {}
+jobs_lock = threading.Lock()
+
+
+def start_job(job_id=None, session_id=None, supersede=False):
+    """Register a job; with `supersede`, cancel the session's previous one."""
+    job = Job(job_id or uuid.uuid4().hex, session_id)
+    with jobs_lock:
+        if supersede and session_id in session_jobs:
+            previous = jobs.get(session_jobs[session_id])
+            if previous is not None:
+                print(f"🛑 Superseding job {previous.job_id} of session {session_id}")
+                previous.cancel()
+        jobs[job.job_id] = job
+        if session_id is not None:
+            session_jobs[session_id] = job.job_id
+    return job
+
+
+def finish_job(job):
+    job.done = True
+    with jobs_lock:
+        if jobs.get(job.job_id) is job:
+            del jobs[job.job_id]
+        if job.session_id is not None and session_jobs.get(job.session_id) == job.job_id:
+            del session_jobs[job.session_id]
+
+
+def cancel_job(job_id):
+    """Cancel a running job. Returns False if no such job is running."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return False
+    job.cancel()
+    return True
+
+
+async def watch_disconnect(request, job, interval=0.25):
+    """Cancel `job` if the client goes away before it finishes."""
+    while not job.done and not job.cancelled.is_set():
+        if await request.is_disconnected():
+            print(f"🔌 Client disconnected, cancelling job {job.job_id}")
+            job.cancel()
+            return
+        await asyncio.sleep(interval)
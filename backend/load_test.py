@@ -0,0 +1,336 @@
+"""Concurrent load test for the render and extraction endpoints.
+
+Starts the API in-process on a local port and drives /api/render-page and
+/api/extract-text from a pool of client threads. Unless --real-ocr is
+given, EasyOCR is replaced by StubOCRReader, which answers after a fixed
+delay, so runs are fast and repeatable.
+
+    python load_test.py --concurrency 8 --requests 200 --mix render=3,extract=1
+    python load_test.py --pdf test_valid.pdf --real-ocr --requests 20
+
+Reports latency percentiles, throughput and error rate per endpoint, plus
+the RSS of the process (server and clients together) over time.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+import requests
+import uvicorn
+
+import main
+import ocr_api
+from recognition_cache import recognition_cache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PROFILES = ["W18X35", "W16X26", "W24X62", "W12X14", "W21X44"]
+
+
+class StubOCRReader:
+    """Deterministic stand-in for easyocr.Reader.
+
+    readtext and detect sleep `latency` seconds per call, recognize sleeps
+    `recognize_latency` per box. Results are a beam label and a bracketed
+    stud count picked from the image content, so identical crops always
+    give identical results.
+    """
+
+    def __init__(self, latency=0.05, recognize_latency=0.005):
+        self.latency = latency
+        self.recognize_latency = recognize_latency
+        self.calls = 0
+
+    def readtext(self, image, allowlist=None, detail=1, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._tokens(image)
+
+    def readtext_batched(self, images, allowlist=None, detail=1, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._tokens(image) for image in images]
+
+    def detect(self, images, reformat=True, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if images.ndim == 2 or (reformat and images.ndim == 3):
+            images = [images]
+        horizontal = []
+        for image in images:
+            boxes = [[0, b[1][0], b[0][1], b[2][1]] for (b, _, _) in self._tokens(image[..., 0] if image.ndim == 3 else image)]
+            horizontal.append(boxes)
+        return horizontal, [[] for _ in horizontal]
+
+    def recognize(self, image, horizontal_list=None, free_list=None, allowlist=None, detail=1, **kwargs):
+        self.calls += 1
+        time.sleep(self.recognize_latency * len(horizontal_list or []))
+        results = []
+        for x_min, x_max, y_min, y_max in horizontal_list or []:
+            crop = image[y_min:y_max, x_min:x_max]
+            seed = zlib.crc32(crop[::4, ::4].tobytes())
+            text = PROFILES[seed % len(PROFILES)] if y_min == 0 else f"[{6 + seed % 55}]"
+            results.append(([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]], text, 0.9))
+        return results
+
+    def _tokens(self, image):
+        h, w = image.shape[:2]
+        seed = zlib.crc32(image[::8, ::8].tobytes())
+        label = PROFILES[seed % len(PROFILES)]
+        val = 6 + seed % 55
+        bw, bh = min(w, 120), min(h, 30)
+        return [
+            ([[0, 0], [bw, 0], [bw, bh], [0, bh]], label, 0.9),
+            ([[0, bh], [bw, bh], [bw, 2 * bh], [0, 2 * bh]], f"[{val}]", 0.9),
+        ]
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # Peak RSS only (KiB on Linux, bytes on macOS) where /proc is unavailable
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_test_pdf(pages=4):
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page(width=1224, height=792)
+        for j in range(30):
+            x, y = 60 + (j % 6) * 180, 80 + (j // 6) * 130
+            page.insert_text((x, y), f"{PROFILES[(i + j) % len(PROFILES)]} [{6 + (i * 7 + j) % 50}]")
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return None
+    k = max(0, min(len(sorted_vals) - 1, int(round(pct / 100 * len(sorted_vals))) - 1))
+    return sorted_vals[k]
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("render", "extract"):
+            raise ValueError(f"Unknown request type in mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def start_server(port):
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LoadTest:
+    def __init__(self, base_url, pdf_bytes, page_sizes, args):
+        self.base_url = base_url
+        self.pdf_bytes = pdf_bytes
+        self.page_sizes = page_sizes  # (width, height) of each page.rect
+        self.args = args
+        self.weights = parse_mix(args.mix)
+        self.results = []  # (kind, latency_s, ok)
+        self.lock = threading.Lock()
+        self.rss_samples = []  # (elapsed_s, rss_mb)
+
+    def _request(self, session, rng):
+        kind = rng.choices(list(self.weights), weights=list(self.weights.values()))[0]
+        page_num = rng.randrange(len(self.page_sizes))
+        files = {"pdf": ("load.pdf", self.pdf_bytes, "application/pdf")}
+        if kind == "render":
+            url = f"{self.base_url}/api/render-page"
+            data = {"page_num": page_num, "zoom": self.args.zoom}
+        else:
+            url = f"{self.base_url}/api/extract-text"
+            # Keep the box on the page whatever its size
+            page_width, page_height = self.page_sizes[page_num]
+            width, height = min(300, page_width), min(200, page_height)
+            if self.args.repeat_regions:
+                x, y = min(50, page_width - width), min(50, page_height - height)
+            else:
+                # Random boxes so the OCR token cache does not answer every request
+                x, y = rng.uniform(0, page_width - width), rng.uniform(0, page_height - height)
+            data = {"x": x, "y": y, "width": width, "height": height, "page_num": page_num}
+
+        start = time.perf_counter()
+        try:
+            resp = session.post(url, data=data, files=files, timeout=self.args.timeout)
+            ok = resp.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return kind, time.perf_counter() - start, ok
+
+    def _worker(self, worker_id, remaining):
+        rng = random.Random(self.args.seed + worker_id)
+        session = requests.Session()
+        while True:
+            with self.lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            result = self._request(session, rng)
+            with self.lock:
+                self.results.append(result)
+
+    def _sample_rss(self, start, stop):
+        while not stop.is_set():
+            self.rss_samples.append((time.perf_counter() - start, current_rss_mb()))
+            stop.wait(self.args.sample_interval)
+
+    def run(self):
+        remaining = [self.args.requests]
+        stop = threading.Event()
+        start = time.perf_counter()
+        sampler = threading.Thread(target=self._sample_rss, args=(start, stop), daemon=True)
+        sampler.start()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            for worker_id in range(self.args.concurrency):
+                pool.submit(self._worker, worker_id, remaining)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+        self.rss_samples.append((elapsed, current_rss_mb()))
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        rss = [r for _, r in self.rss_samples if r is not None]
+        summary = {
+            "concurrency": self.args.concurrency,
+            "requests": len(self.results),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(self.results) / elapsed if elapsed else 0,
+            "endpoints": {},
+            "rss_mb": {
+                "start": rss[0] if rss else None,
+                "peak": max(rss, default=None),
+                "end": rss[-1] if rss else None,
+                "samples": [[round(t, 2), round(r, 1)] for t, r in self.rss_samples if r is not None],
+            },
+        }
+        for kind in self.weights:
+            rows = [r for r in self.results if r[0] == kind]
+            lat = sorted(r[1] * 1000 for r in rows)
+            errors = sum(1 for r in rows if not r[2])
+            summary["endpoints"][kind] = {
+                "count": len(rows),
+                "errors": errors,
+                "error_rate": errors / len(rows) if rows else 0,
+                "throughput_rps": len(rows) / elapsed if elapsed else 0,
+                "p50_ms": percentile(lat, 50),
+                "p90_ms": percentile(lat, 90),
+                "p99_ms": percentile(lat, 99),
+                "max_ms": lat[-1] if lat else None,
+            }
+        return summary
+
+
+def print_summary(summary):
+    print(f"\n📊 {summary['requests']} requests, concurrency {summary['concurrency']}, "
+          f"{summary['elapsed_s']:.1f}s, {summary['throughput_rps']:.1f} req/s")
+    print(f"{'endpoint':<10}{'count':>7}{'err%':>7}{'rps':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+    for kind, s in summary["endpoints"].items():
+        if not s["count"]:
+            continue
+        print(f"{kind:<10}{s['count']:>7}{s['error_rate'] * 100:>6.1f}%{s['throughput_rps']:>8.1f}"
+              f"{s['p50_ms']:>9.0f}{s['p90_ms']:>9.0f}{s['p99_ms']:>9.0f}{s['max_ms']:>9.0f}")
+    rss = summary["rss_mb"]
+    if rss["peak"] is not None:
+        print(f"🧠 RSS: start {rss['start']:.0f} MB, peak {rss['peak']:.0f} MB, end {rss['end']:.0f} MB")
+    cache = summary.get("recognition_cache")
+    if cache and cache["enabled"]:
+        print(f"♻️ Recognition cache: {cache['hit_rate'] * 100:.1f}% hits, {cache['size']} entries")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="PDF to upload (default: generated drawing set)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--mix", default="render=1,extract=1",
+                        help="weighted request mix, e.g. render=3,extract=1")
+    parser.add_argument("--zoom", type=float, default=2.0, help="zoom for render-page")
+    parser.add_argument("--repeat-regions", action="store_true",
+                        help="always extract the same box (measures the token cache path)")
+    parser.add_argument("--real-ocr", action="store_true", help="use EasyOCR instead of the stub")
+    parser.add_argument("--ocr-latency", type=float, default=0.05,
+                        help="seconds per stub OCR call")
+    parser.add_argument("--recognize-latency", type=float, default=0.005,
+                        help="seconds per box recognized by the stub")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="RSS sampling period (s)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the summary to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the API's own logging")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = make_test_pdf()
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_sizes = [(page.rect.width, page.rect.height) for page in doc]
+
+    if not args.real_ocr:
+        # get_ocr_reader() returns the existing reader instead of loading EasyOCR
+        ocr_api.ocr_reader = StubOCRReader(latency=args.ocr_latency, recognize_latency=args.recognize_latency)
+
+    port = free_port()
+    server, thread = start_server(port)
+    print(f"🚀 Load testing http://127.0.0.1:{port} ({'EasyOCR' if args.real_ocr else 'stub OCR'})")
+    # The endpoints print per request; keep that out of the report unless asked
+    # (to devnull, so the discarded log does not grow the RSS being measured)
+    try:
+        with open(os.devnull, "w") as devnull:
+            quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+            with quiet:
+                summary = LoadTest(f"http://127.0.0.1:{port}", pdf_bytes, page_sizes, args).run()
+    finally:
+        server.should_exit = True
+        thread.join()
+
+    summary["recognition_cache"] = recognition_cache.stats()
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    main_cli()
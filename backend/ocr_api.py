@@ -0,0 +1,429 @@
+"""OCR extraction endpoints.
+
+Everything here needs numpy/OpenCV (and EasyOCR on first use), so main.py
+only imports this module when the process serves the OCR role.
+"""
+import json
+import asyncio
+import threading
+import numpy as np
+import fitz  # PyMuPDF
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+import tempfile
+import os
+import time
+
+from extraction import (
+    rasterize_gray, crop_from_raster, run_ocr_passes, log_unique_results,
+    spatial_extract, combine_results,
+)
+from revisions import (
+    projects, token_cache, fingerprint_page, fingerprint_region, get_tokens, put_tokens, record_takeoff,
+    takeoff_key, is_current_page, apply_revision,
+)
+from search_index import document_id, build_index, add_ocr_tokens, search
+from recognition_cache import recognition_cache
+from raster_cache import raster_cache
+from jobs import ExtractionCancelled, start_job, finish_job, cancel_job, watch_disconnect
+
+router = APIRouter()
+
+# Render the missing regions as one clip only while their union is at most
+# this many times their combined area; otherwise render each on its own
+REGION_UNION_MAX_RATIO = 1.5
+
+# Initialize EasyOCR reader (lazy load)
+ocr_reader = None
+ocr_reader_lock = threading.Lock()
+
+def get_ocr_reader():
+    global ocr_reader
+    # OCR runs on worker threads; make sure only one of them loads the model
+    with ocr_reader_lock:
+        if ocr_reader is None:
+            import easyocr
+            print("🔄 Initializing EasyOCR...")
+            # gpu=False for cpu-only environments
+            ocr_reader = easyocr.Reader(['en'], gpu=False)
+            print("✅ EasyOCR ready!")
+    return ocr_reader
+
+def check_current_revision(project_id, page_num, page_fingerprint):
+    """Refuse takeoffs on a PDF that is not the project's current revision."""
+    if not is_current_page(project_id, page_num, page_fingerprint):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Page {page_num} does not match the current revision of project {project_id}",
+        )
+
+async def extract_page_regions(page, rects, doc_id=None, job=None):
+    """Run the extraction for each rect on one page.
+
+    Regions whose rendered content was seen before reuse the cached OCR
+    tokens; the rest are rasterized (together if they sit close to each
+    other, one by one otherwise) and OCR'd in batches.
+    If `doc_id` has a search index, the tokens are added to it.
+    Returns (fingerprints, results) in the order of `rects`.
+
+    Rendering stays on the event loop (PyMuPDF is not thread-safe); the OCR
+    passes run in the threadpool. Once `job` is cancelled, the work stops
+    at the next region, strip or OCR pass.
+    With the raster cache on, crops are sliced out of the page raster kept
+    on disk instead of being rendered for every request; the first request
+    for a page renders it in strips, yielding to other requests in between.
+    """
+    check_cancelled = job.check if job else (lambda: None)
+    fingerprints = []
+    for r in rects:
+        fingerprints.append(fingerprint_region(page, r))
+        await asyncio.sleep(0)
+        check_cancelled()
+    tokens = [get_tokens(f) for f in fingerprints]
+    missing = [i for i, t in enumerate(tokens) if t is None]
+    print(f"♻️ Reusing cached OCR tokens for {len(rects) - len(missing)}/{len(rects)} regions")
+
+    if missing:
+        use_raster_cache = raster_cache.enabled and doc_id is not None
+        if use_raster_cache:
+            raster = await raster_cache.page_raster(doc_id, page, check_cancelled=check_cancelled)
+            raster_rect = fitz.Rect(page.rect)
+            grays = [np.ascontiguousarray(crop_from_raster(raster, raster_rect, rects[i])) for i in missing]
+        else:
+            union = fitz.Rect(rects[missing[0]])
+            for i in missing[1:]:
+                union |= rects[i]
+            if union.get_area() <= REGION_UNION_MAX_RATIO * sum(rects[i].get_area() for i in missing):
+                # Regions close together: rasterize the area covering them once, then slice the crops out
+                raster = rasterize_gray(page, union)
+                print(f"🖼️ Rasterized {raster.shape[1]}x{raster.shape[0]} for {len(missing)} regions")
+                grays = [np.ascontiguousarray(crop_from_raster(raster, union, rects[i])) for i in missing]
+            else:
+                # Spread over the sheet: one clip per region, letting other requests in between
+                grays = []
+                for i in missing:
+                    grays.append(rasterize_gray(page, rects[i]))
+                    await asyncio.sleep(0)
+                    check_cancelled()
+                print(f"🖼️ Rasterized {len(missing)} regions separately")
+
+        check_cancelled()
+
+        page_num = page.number
+
+        def ocr():
+            variants = None
+            if use_raster_cache and raster_cache.cache_variants:
+                page_variants = raster_cache.page_variants(doc_id, page_num)
+                if page_variants is not None:
+                    variants = [
+                        tuple(np.ascontiguousarray(crop_from_raster(v, raster_rect, rects[i]))
+                              for v in page_variants)
+                        for i in missing
+                    ]
+            return run_ocr_passes(get_ocr_reader(), grays, check_cancelled, variants)
+
+        ocr_results = await run_in_threadpool(ocr)
+        for i, all_ocr_results in zip(missing, ocr_results):
+            put_tokens(fingerprints[i], all_ocr_results)
+            tokens[i] = all_ocr_results
+
+    results = []
+    for rect, all_ocr_results in zip(rects, tokens):
+        if doc_id is not None:
+            add_ocr_tokens(doc_id, page.number, rect, all_ocr_results)
+        log_unique_results(all_ocr_results)
+        results.append(spatial_extract(all_ocr_results))
+    return fingerprints, results
+
+@router.post("/api/extract-text")
+async def extract_text(
+    request: Request,
+    pdf: UploadFile = File(...),
+    x: float = Form(...),
+    y: float = Form(...),
+    width: float = Form(...),
+    height: float = Form(...),
+    page_num: int = Form(0),
+    project_id: str = Form(None),
+    job_id: str = Form(None),
+    session_id: str = Form(None),
+    supersede: bool = Form(False)
+):
+    print(f"📥 Extraction Request: Page {page_num}, Region ({x},{y}) {width}x{height}")
+    if project_id is not None and project_id not in projects:
+        raise HTTPException(status_code=404, detail="Unknown project")
+    job = start_job(job_id, session_id, supersede)
+    watcher = asyncio.create_task(watch_disconnect(request, job))
+    tmp_path = None
+    doc = None
+    try:
+        # Save uploaded PDF to a temporary file
+        contents = await pdf.read()
+        print(f"📄 Read {len(contents)} bytes for extraction")
+        
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+            tmp.write(contents)
+            tmp_path = tmp.name
+            
+        print(f"💾 Saved to temp file: {tmp_path}")
+        doc = fitz.open(tmp_path)
+        
+        if page_num >= len(doc):
+            raise HTTPException(status_code=400, detail="Page number out of range")
+            
+        page = doc[page_num]
+        if project_id is not None:
+            page_fingerprint = fingerprint_page(page)
+            check_current_revision(project_id, page_num, page_fingerprint)
+        
+        # Define crop rectangle (PDF coordinates)
+        rect = fitz.Rect(x, y, x + width, y + height)
+        
+        # Extract text directly from PDF for accuracy
+        text_instances = page.get_text("words", clip=rect)
+        std_text = " ".join([w[4] for w in text_instances])
+        
+        # OCR the crop (or reuse tokens if this region was seen unchanged before)
+        fingerprints, results = await extract_page_regions(page, [rect], document_id(contents), job)
+        if project_id is not None:
+            # A new revision may have been registered while this one was OCR'd
+            check_current_revision(project_id, page_num, page_fingerprint)
+            record_takeoff(project_id, page_num, rect, fingerprints[0], results[0])
+
+        return results[0]
+
+    except HTTPException:
+        raise
+    except ExtractionCancelled:
+        print(f"🛑 Extraction cancelled: job {job.job_id}")
+        raise HTTPException(status_code=499, detail="Extraction cancelled")
+    except Exception as e:
+        print("❌ Extraction Error:")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        finish_job(job)
+        watcher.cancel()
+        if doc:
+            try:
+                doc.close()
+            except:
+                pass
+        
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+                print(f"🧹 Removed temp file: {tmp_path}")
+            except Exception as cleanup_err:
+                print(f"⚠️ Cleanup failed: {cleanup_err}")
+
+@router.post("/api/extract-regions")
+async def extract_regions(
+    request: Request,
+    pdf: UploadFile = File(...),
+    regions: str = Form(...),
+    page_num: int = Form(0),
+    project_id: str = Form(None),
+    job_id: str = Form(None),
+    session_id: str = Form(None),
+    supersede: bool = Form(False)
+):
+    """Extract several regions of one page in a single call.
+
+    `regions` is a JSON list of {"x", "y", "width", "height"} objects in the
+    same PDF coordinates as /api/extract-text. The page is rasterized once
+    and the crops go through OCR in batches.
+    """
+    try:
+        rect_specs = json.loads(regions)
+        rects = [fitz.Rect(r["x"], r["y"], r["x"] + r["width"], r["y"] + r["height"])
+                 for r in rect_specs]
+    except (ValueError, TypeError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid regions: {e}")
+    if not rects:
+        raise HTTPException(status_code=400, detail="No regions given")
+    if project_id is not None and project_id not in projects:
+        raise HTTPException(status_code=404, detail="Unknown project")
+
+    print(f"📥 Multi-Region Request: Page {page_num}, {len(rects)} regions")
+    job = start_job(job_id, session_id, supersede)
+    watcher = asyncio.create_task(watch_disconnect(request, job))
+    doc = None
+    try:
+        contents = await pdf.read()
+        print(f"📄 Read {len(contents)} bytes for extraction")
+        doc = fitz.open(stream=contents, filetype="pdf")
+
+        if page_num >= len(doc):
+            raise HTTPException(status_code=400, detail="Page number out of range")
+
+        page = doc[page_num]
+        rects = [r & page.rect for r in rects]
+        if any(r.is_empty for r in rects):
+            raise HTTPException(status_code=400, detail="Region outside of page")
+        if project_id is not None:
+            page_fingerprint = fingerprint_page(page)
+            check_current_revision(project_id, page_num, page_fingerprint)
+
+        fingerprints, region_results = await extract_page_regions(page, rects, document_id(contents), job)
+        if project_id is not None:
+            check_current_revision(project_id, page_num, page_fingerprint)
+            for rect, fingerprint, result in zip(rects, fingerprints, region_results):
+                record_takeoff(project_id, page_num, rect, fingerprint, result)
+
+        return {
+            "success": True,
+            "regions": region_results,
+            **combine_results(region_results),
+        }
+
+    except HTTPException:
+        raise
+    except ExtractionCancelled:
+        print(f"🛑 Extraction cancelled: job {job.job_id}")
+        raise HTTPException(status_code=499, detail="Extraction cancelled")
+    except Exception as e:
+        print("❌ Extraction Error:")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        finish_job(job)
+        watcher.cancel()
+        if doc:
+            doc.close()
+
+@router.post("/api/jobs/{job_id}/cancel")
+async def cancel_extraction(job_id: str):
+    """Cancel a running extraction started with this `job_id`."""
+    if not cancel_job(job_id):
+        raise HTTPException(status_code=404, detail="No running job with this id")
+    print(f"🛑 Cancel requested for job {job_id}")
+    return {"success": True, "job_id": job_id}
+
+@router.post("/api/upload-revision")
+async def upload_revision(
+    pdf: UploadFile = File(...),
+    project_id: str = Form(...),
+    reextract: bool = Form(False)
+):
+    """Register a new revision of a drawing set and diff it against the last one.
+
+    Takeoffs recorded for the project carry over wherever their page or
+    region is unchanged, following the page if it moved. With `reextract`,
+    stale takeoffs are extracted again right away; otherwise they are
+    returned for the client to redo. Takeoffs on pages that were removed
+    are returned under "removed" with their old page number.
+    """
+    print(f"📥 Revision Upload: Project {project_id}")
+    doc = None
+    try:
+        contents = await pdf.read()
+        print(f"📄 Read {len(contents)} bytes for revision")
+        doc = fitz.open(stream=contents, filetype="pdf")
+
+        project, pages, stale, removed = await apply_revision(project_id, doc)
+        print(f"🔍 Revision {project['revision']}: {len(pages['changed'])} changed, "
+              f"{len(pages['added'])} added, {len(pages['removed'])} removed, "
+              f"{len(pages['moved'])} moved pages")
+
+        carried_over = list(project["takeoffs"].values())
+        reextracted = []
+        if reextract and stale:
+            doc_id = document_id(contents)
+            by_page = {}
+            for takeoff in stale:
+                by_page.setdefault(takeoff["page_num"], []).append(fitz.Rect(takeoff["rect"]))
+            for page_num, rects in by_page.items():
+                fingerprints, results = await extract_page_regions(doc[page_num], rects, doc_id)
+                for rect, fingerprint, result in zip(rects, fingerprints, results):
+                    record_takeoff(project_id, page_num, rect, fingerprint, result)
+                    reextracted.append(project["takeoffs"][takeoff_key(page_num, rect)])
+            stale = []
+
+        return {
+            "success": True,
+            "project_id": project_id,
+            "revision": project["revision"],
+            "page_count": len(doc),
+            "pages": pages,
+            "takeoffs": {
+                "carried_over": carried_over,
+                "reextracted": reextracted,
+                "stale": stale,
+                "removed": removed,
+            },
+        }
+
+    except Exception as e:
+        print("❌ Revision Error:")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if doc:
+            doc.close()
+
+@router.post("/api/index-document")
+async def index_document(pdf: UploadFile = File(...)):
+    """Build the word index used by /api/search (once per document)."""
+    doc = None
+    try:
+        contents = await pdf.read()
+        doc_id = document_id(contents)
+        start_time = time.perf_counter()
+        doc = fitz.open(stream=contents, filetype="pdf")
+        index, built = build_index(doc_id, doc)
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        if built:
+            print(f"🗂️ Indexed {index['page_count']} pages, {len(index['terms'])} terms in {elapsed_ms:.0f}ms")
+
+        return {
+            "success": True,
+            "doc_id": doc_id,
+            "page_count": index["page_count"],
+            "term_count": len(index["terms"]),
+            "cached": not built,
+        }
+
+    except Exception as e:
+        print("❌ Index Error:")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if doc:
+            doc.close()
+
+@router.get("/api/search")
+async def search_document(doc_id: str, q: str, limit: int = 500):
+    """Find a profile (e.g. W18x35) across all pages of an indexed document.
+
+    Bboxes are in the same PDF coordinates the extraction endpoints take.
+    """
+    start_time = time.perf_counter()
+    found = search(doc_id, q)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Document not indexed")
+    term, matches = found
+
+    return {
+        "success": True,
+        "query": q,
+        "normalized": term,
+        "total": len(matches),
+        "pages": sorted({m["page_num"] for m in matches}),
+        "matches": matches[:limit],
+        "elapsed_ms": (time.perf_counter() - start_time) * 1000,
+    }
+
+@router.get("/api/cache-stats")
+async def cache_stats():
+    """Hit rates of the OCR caches."""
+    return {
+        "recognition": recognition_cache.stats(),
+        "region_tokens": {"size": len(token_cache)},
+        "raster": raster_cache.stats(),
+    }
@@ -0,0 +1,253 @@
+import os
+import asyncio
+import atexit
+import shutil
+import tempfile
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+import fitz  # PyMuPDF
+
+from extraction import OCR_ZOOM, rasterize_gray, preprocess
+
+# Setting a directory turns the cache on
+RASTER_CACHE_DIR = os.environ.get("RASTER_CACHE_DIR")
+# Total size of raster files kept on disk
+RASTER_CACHE_MAX_BYTES = int(os.environ.get("RASTER_CACHE_MAX_BYTES", str(8 * 1024**3)))
+# Total size of files kept mapped at once (bounds the page-cache footprint)
+RASTER_CACHE_MAX_MAPPED_BYTES = int(os.environ.get("RASTER_CACHE_MAX_MAPPED_BYTES", str(2 * 1024**3)))
+# Also keep the sharpened/adaptive/dilated variants of each page
+RASTER_CACHE_VARIANTS = os.environ.get("RASTER_CACHE_VARIANTS", "0") == "1"
+# Pixel rows rendered per step when a page is first cached; the event loop
+# gets control back between steps
+RASTER_STRIP_ROWS = 512
+
+VARIANT_NAMES = ("sharpened", "adaptive", "final")
+
+
+class RasterCache:
+    """Whole pages rasterized once at OCR zoom into grayscale np.memmap files.
+
+    Region extractions slice their crops out of the page raster instead of
+    rendering again. Pages are evicted least recently used first when the
+    files on disk exceed `max_bytes`; maps beyond `max_mapped_bytes` are
+    closed and reopened on next use.
+
+    Each process keeps its files in its own subdirectory of `cache_dir`, so
+    workers and replicas sharing the directory never touch each other's
+    files. Every write goes to a new file name, so a file is never replaced
+    while mapped; files that cannot be removed yet (Windows refuses while a
+    view is still alive) are retried on later evictions.
+    """
+
+    def __init__(self, cache_dir, max_bytes, max_mapped_bytes, cache_variants=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_mapped_bytes = max_mapped_bytes
+        self.cache_variants = cache_variants
+        # (doc_id, page_num) -> {"shape", "files": {name: path}, "maps": {name: memmap}, "lock"}
+        self.entries = OrderedDict()
+        # (doc_id, page_num) -> future set once the page being rendered is cached
+        self.rendering = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sequence = itertools.count()
+        self.pending_removals = []
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.cache_dir = tempfile.mkdtemp(prefix=f"raster_{os.getpid()}_", dir=cache_dir)
+            atexit.register(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    @property
+    def enabled(self):
+        return bool(self.cache_dir)
+
+    def _path(self, doc_id, page_num, name):
+        return os.path.join(self.cache_dir, f"{doc_id}_{page_num}_{name}_{next(self.sequence)}.raw")
+
+    def _write(self, path, array):
+        mm = np.memmap(path, dtype=np.uint8, mode="w+", shape=array.shape)
+        mm[:] = array
+        mm.flush()
+        del mm
+        return np.memmap(path, dtype=np.uint8, mode="r", shape=array.shape)
+
+    def _remove(self, path):
+        # Called with self.lock held
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Still mapped somewhere (Windows); try again on a later eviction
+            self.pending_removals.append(path)
+
+    def _entry_bytes(self, entry):
+        return len(entry["files"]) * entry["shape"][0] * entry["shape"][1]
+
+    def _map(self, entry, name):
+        mm = entry["maps"].get(name)
+        if mm is None:
+            mm = np.memmap(entry["files"][name], dtype=np.uint8, mode="r", shape=entry["shape"])
+            entry["maps"][name] = mm
+        return mm
+
+    def _enforce_limits(self, keep):
+        # Called with self.lock held
+        pending, self.pending_removals = self.pending_removals, []
+        for path in pending:
+            self._remove(path)
+
+        total = sum(self._entry_bytes(e) for e in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            total -= self._entry_bytes(entry)
+            entry["maps"].clear()
+            for path in entry["files"].values():
+                self._remove(path)
+            self.evictions += 1
+
+        mapped = sum(len(e["maps"]) * e["shape"][0] * e["shape"][1] for e in self.entries.values())
+        for key, entry in self.entries.items():
+            if mapped <= self.max_mapped_bytes:
+                break
+            if key == keep or not entry["maps"]:
+                continue
+            mapped -= len(entry["maps"]) * entry["shape"][0] * entry["shape"][1]
+            # Views handed out earlier keep their own reference until released
+            entry["maps"].clear()
+
+    async def _render_strips(self, page, path, zoom, check_cancelled):
+        """Render the page into a new memmap file a strip at a time."""
+        matrix = fitz.Matrix(zoom, zoom)
+        origin = (page.rect * matrix).irect
+        mm = np.memmap(path, dtype=np.uint8, mode="w+", shape=(origin.height, origin.width))
+        for top in range(0, origin.height, RASTER_STRIP_ROWS):
+            bottom = min(top + RASTER_STRIP_ROWS, origin.height)
+            strip_rect = fitz.Rect(page.rect.x0, (origin.y0 + top) / zoom,
+                                   page.rect.x1, (origin.y0 + bottom) / zoom)
+            strip = rasterize_gray(page, strip_rect, zoom)
+            target = (strip_rect * matrix).irect
+            y0, x0 = target.y0 - origin.y0, target.x0 - origin.x0
+            mm[y0:y0 + strip.shape[0], x0:x0 + strip.shape[1]] = strip
+            await asyncio.sleep(0)
+            check_cancelled()
+        mm.flush()
+        del mm
+        return np.memmap(path, dtype=np.uint8, mode="r", shape=(origin.height, origin.width))
+
+    async def page_raster(self, doc_id, page, zoom=OCR_ZOOM, check_cancelled=None):
+        """Grayscale raster of the whole page, rendering it on first use.
+
+        Renders with PyMuPDF, so await it on the event loop. A miss renders
+        in strips of RASTER_STRIP_ROWS and yields between them, so other
+        requests (cancels, disconnect checks) keep being served; concurrent
+        requests for the same page wait for the one render.
+        `check_cancelled` is called between strips and may raise to stop
+        rendering; a waiting request then renders the page itself.
+        """
+        check_cancelled = check_cancelled or (lambda: None)
+        key = (doc_id, page.number)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    raster = self._map(entry, "gray")
+                    self._enforce_limits(key)
+                    return raster
+                rendering = self.rendering.get(key)
+                if rendering is None:
+                    self.misses += 1
+                    rendering = asyncio.get_running_loop().create_future()
+                    self.rendering[key] = rendering
+                    break
+            # Look again once it is done; it may have failed or been evicted
+            await asyncio.shield(rendering)
+
+        path = self._path(doc_id, page.number, "gray")
+        try:
+            raster = await self._render_strips(page, path, zoom, check_cancelled)
+            print(f"🗄️ Cached page {page.number} raster {raster.shape[1]}x{raster.shape[0]} at {path}")
+            with self.lock:
+                self.entries[key] = {
+                    "shape": raster.shape,
+                    "files": {"gray": path},
+                    "maps": {"gray": raster},
+                    "lock": threading.Lock(),
+                }
+                self._enforce_limits(key)
+            return raster
+        except BaseException:
+            with self.lock:
+                self._remove(path)
+            raise
+        finally:
+            with self.lock:
+                del self.rendering[key]
+            rendering.set_result(None)
+
+    def page_variants(self, doc_id, page_num):
+        """Preprocessed variants of a cached page, computed on first use.
+
+        Returns None if the page is not cached. Safe to call from workers.
+        """
+        key = (doc_id, page_num)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        with entry["lock"]:
+            if VARIANT_NAMES[0] not in entry["files"]:
+                with self.lock:
+                    if self.entries.get(key) is not entry:
+                        return None
+                    gray = np.asarray(self._map(entry, "gray"))
+                for name, array in zip(VARIANT_NAMES, preprocess(gray)):
+                    path = self._path(doc_id, page_num, name)
+                    mm = self._write(path, array)
+                    with self.lock:
+                        if self.entries.get(key) is not entry:
+                            # Evicted meanwhile; nothing else knows about this file
+                            del mm
+                            self._remove(path)
+                            return None
+                        entry["files"][name] = path
+                        entry["maps"][name] = mm
+                with self.lock:
+                    self._enforce_limits(key)
+            with self.lock:
+                if self.entries.get(key) is not entry:
+                    return None
+                return tuple(self._map(entry, name) for name in VARIANT_NAMES)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "variants": self.cache_variants,
+                "pages": len(self.entries),
+                "disk_bytes": sum(self._entry_bytes(e) for e in self.entries.values()),
+                "mapped_bytes": sum(len(e["maps"]) * e["shape"][0] * e["shape"][1]
+                                    for e in self.entries.values()),
+                "max_bytes": self.max_bytes,
+                "max_mapped_bytes": self.max_mapped_bytes,
+                "pending_removals": len(self.pending_removals),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+raster_cache = RasterCache(RASTER_CACHE_DIR, RASTER_CACHE_MAX_BYTES,
+                           RASTER_CACHE_MAX_MAPPED_BYTES, RASTER_CACHE_VARIANTS)
@@ -0,0 +1,175 @@
+import os
+import hashlib
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+# In-memory entries; 0 disables the cache
+RECOGNITION_CACHE_SIZE = int(os.environ.get("RECOGNITION_CACHE_SIZE", "50000"))
+# Optional directory for a persistent tier shared across restarts
+RECOGNITION_CACHE_DIR = os.environ.get("RECOGNITION_CACHE_DIR")
+# Rows kept in the persistent tier; the least recently used go first
+RECOGNITION_CACHE_DISK_SIZE = int(os.environ.get("RECOGNITION_CACHE_DISK_SIZE", "1000000"))
+# Rows written between checks of the persistent tier's size
+DISK_PRUNE_INTERVAL = 1000
+
+# Crops are scaled to this height (keeping aspect) before hashing
+HASH_HEIGHT = 24
+HASH_MAX_WIDTH = 384
+
+
+def crop_hash(crop, allowlist=""):
+    """Perceptual key for a text crop.
+
+    The crop is binarized, trimmed to its ink, scaled to a fixed height and
+    hashed, so the same label rendered at a slightly different offset or box
+    size maps to the same key. Returns None for crops with no ink.
+    """
+    if crop.size == 0 or crop.min() == crop.max():
+        return None
+    _, binary = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    points = cv2.findNonZero(binary)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    ink = binary[y:y + h, x:x + w]
+    width = int(min(max(round(HASH_HEIGHT * w / h / 4) * 4, 4), HASH_MAX_WIDTH))
+    small = cv2.resize(ink, (width, HASH_HEIGHT), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(small > 127)
+    digest = hashlib.sha1(f"{width}x{HASH_HEIGHT}:{allowlist}:".encode())
+    digest.update(bits.tobytes())
+    return digest.hexdigest()
+
+
+class RecognitionCache:
+    """LRU of recognized (text, confidence) per crop hash.
+
+    With `disk_dir`, entries are also written to a SQLite file there and
+    memory misses fall back to it. The file keeps at most `max_disk_entries`
+    rows, dropping the least recently used. It has its own lock, so memory
+    lookups never wait on disk I/O.
+    """
+
+    def __init__(self, max_entries, disk_dir=None, max_disk_entries=RECOGNITION_CACHE_DISK_SIZE):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.db = None
+        self.db_lock = threading.Lock()
+        # Keys read from disk since the last write; their `used` time is bumped then
+        self.touched = set()
+        self.writes_since_prune = 0
+        if disk_dir and max_entries > 0:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(disk_dir, "recognition.sqlite"), check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=OFF")
+            self.db.execute("CREATE TABLE IF NOT EXISTS recognition "
+                            "(key TEXT PRIMARY KEY, text TEXT, conf REAL, used REAL DEFAULT 0)")
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(recognition)")]
+            if "used" not in columns:
+                # File from before the size cap
+                self.db.execute("ALTER TABLE recognition ADD COLUMN used REAL DEFAULT 0")
+            self.db.execute("CREATE INDEX IF NOT EXISTS recognition_used ON recognition (used)")
+            self.db.commit()
+            self._prune()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune(self):
+        # Called with self.db_lock held (or before the cache is shared)
+        self.writes_since_prune = 0
+        excess = self.db.execute("SELECT COUNT(*) FROM recognition").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            self.db.execute("DELETE FROM recognition WHERE key IN "
+                            "(SELECT key FROM recognition ORDER BY used LIMIT ?)", (excess,))
+            self.db.commit()
+            self.disk_evictions += excess
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.db is not None:
+            with self.db_lock:
+                row = self.db.execute("SELECT text, conf FROM recognition WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.touched.add(key)
+            if row is not None:
+                value = (row[0], row[1])
+                with self.lock:
+                    self._remember(key, value)
+                    self.disk_hits += 1
+                return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put_many(self, items):
+        """Store (key, text, conf) items; text is None when nothing was recognized.
+
+        All items go to disk in one transaction.
+        """
+        items = [(key, text, float(conf)) for key, text, conf in items]
+        if not items:
+            return
+        with self.lock:
+            for key, text, conf in items:
+                self._remember(key, (text, conf))
+        if self.db is None:
+            return
+        now = time.time()
+        with self.db_lock:
+            touched, self.touched = self.touched, set()
+            self.db.executemany("INSERT OR REPLACE INTO recognition VALUES (?, ?, ?, ?)",
+                                [(key, text, conf, now) for key, text, conf in items])
+            self.db.executemany("UPDATE recognition SET used = ? WHERE key = ?",
+                                [(now, key) for key in touched])
+            self.db.commit()
+            self.writes_since_prune += len(items)
+            if self.writes_since_prune >= DISK_PRUNE_INTERVAL:
+                self._prune()
+
+    def put(self, key, text, conf):
+        self.put_many([(key, text, conf)])
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "disk": self.db is not None,
+                "max_disk_entries": self.max_disk_entries,
+                "disk_evictions": self.disk_evictions,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+recognition_cache = RecognitionCache(RECOGNITION_CACHE_SIZE, RECOGNITION_CACHE_DIR)
@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import fitz  # PyMuPDF
+
+# Low-res renders are enough to tell whether anything visible changed
+PAGE_FINGERPRINT_ZOOM = 0.5
+REGION_FINGERPRINT_ZOOM = 1.0
+
+# Pages are also hashed as a PAGE_TILE_GRID x PAGE_TILE_GRID grid of tiles, so a
+# revised sheet can be told apart from a different one by how many tiles it shares
+PAGE_TILE_GRID = 4
+
+# Max number of regions whose OCR tokens are kept in memory
+TOKEN_CACHE_SIZE = 2000
+
+# OCR tokens per region fingerprint, shared by every document and revision
+token_cache = OrderedDict()
+
+# project_id -> {"revision": int, "pages": [fingerprint, ...], "tiles": [[tile hash, ...], ...],
+#                "takeoffs": {key: takeoff}}
+projects = {}
+
+
+def _render(page, zoom, clip=None):
+    return page.get_pixmap(clip=clip, matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+
+
+def _pixmap_hash(pix):
+    h = hashlib.sha1(f"{pix.width}x{pix.height}".encode())
+    h.update(pix.samples)
+    return h.hexdigest()
+
+
+def _render_hash(page, zoom, clip=None):
+    return _pixmap_hash(_render(page, zoom, clip))
+
+
+def fingerprint_page(page):
+    """Hash a low-res render of the whole page."""
+    return _render_hash(page, PAGE_FINGERPRINT_ZOOM)
+
+
+def page_signature(page):
+    """Return (fingerprint, tile hashes) of the page from one low-res render."""
+    pix = _render(page, PAGE_FINGERPRINT_ZOOM)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+    tiles = []
+    for rows in np.array_split(gray, PAGE_TILE_GRID, axis=0):
+        for tile in np.array_split(rows, PAGE_TILE_GRID, axis=1):
+            tiles.append(hashlib.sha1(f"{tile.shape}".encode() + tile.tobytes()).hexdigest())
+    return _pixmap_hash(pix), tiles
+
+
+def fingerprint_region(page, rect):
+    """Hash a render of one region, including where it sits on the page."""
+    rect = fitz.Rect(rect)
+    h = hashlib.sha1(_render_hash(page, REGION_FINGERPRINT_ZOOM, clip=rect).encode())
+    h.update(f"{rect.x0:.1f},{rect.y0:.1f},{rect.x1:.1f},{rect.y1:.1f}".encode())
+    return h.hexdigest()
+
+
+def get_tokens(fingerprint):
+    tokens = token_cache.get(fingerprint)
+    if tokens is not None:
+        token_cache.move_to_end(fingerprint)
+    return tokens
+
+
+def put_tokens(fingerprint, tokens):
+    token_cache[fingerprint] = tokens
+    token_cache.move_to_end(fingerprint)
+    while len(token_cache) > TOKEN_CACHE_SIZE:
+        token_cache.popitem(last=False)
+
+
+def is_current_page(project_id, page_num, fingerprint):
+    """Whether `fingerprint` is page `page_num` of the project's current revision."""
+    pages = projects[project_id]["pages"]
+    return page_num < len(pages) and pages[page_num] == fingerprint
+
+
+def takeoff_key(page_num, rect):
+    rect = fitz.Rect(rect)
+    return f"{page_num}:{rect.x0:.1f},{rect.y0:.1f},{rect.x1:.1f},{rect.y1:.1f}"
+
+
+def record_takeoff(project_id, page_num, rect, fingerprint, result):
+    """Remember an extraction against the project's current revision."""
+    project = projects[project_id]
+    rect = fitz.Rect(rect)
+    project["takeoffs"][takeoff_key(page_num, rect)] = {
+        "page_num": page_num,
+        "rect": [rect.x0, rect.y0, rect.x1, rect.y1],
+        "fingerprint": fingerprint,
+        "result": result,
+    }
+
+
+def _tile_overlap(a, b):
+    return sum(1 for x, y in zip(a, b) if x == y)
+
+
+def match_pages(old_pages, new_pages, old_tiles=None, new_tiles=None):
+    """Pair each new page with the old page it is a revision of.
+
+    Pages with identical fingerprints are paired first, in order, so
+    inserted, removed or reordered sheets do not shift everything after
+    them. Each run of new pages left over sits between two paired pages;
+    if the old pages left over between the same two are as many, they are
+    paired in order. Otherwise a new page is paired with the unpaired old
+    page sharing the most tiles, if that is more than half of them, and
+    left unpaired (added) when there is none. Returns
+    {new_page_num: old_page_num}.
+    """
+    old_by_fingerprint = {}
+    for page_num, fingerprint in enumerate(old_pages):
+        old_by_fingerprint.setdefault(fingerprint, []).append(page_num)
+
+    matches = {}
+    for page_num, fingerprint in enumerate(new_pages):
+        candidates = old_by_fingerprint.get(fingerprint)
+        if candidates:
+            matches[page_num] = candidates.pop(0)
+    anchors = dict(matches)
+    used = set(matches.values())
+
+    unsure = []
+    page_num = 0
+    while page_num < len(new_pages):
+        if page_num in anchors:
+            page_num += 1
+            continue
+        run_end = page_num
+        while run_end < len(new_pages) and run_end not in anchors:
+            run_end += 1
+        before = anchors[page_num - 1] if page_num > 0 else -1
+        after = anchors[run_end] if run_end < len(new_pages) else len(old_pages)
+        old_gap = [n for n in range(before + 1, after) if n not in used]
+        if len(old_gap) == run_end - page_num:
+            for new_num, old_num in zip(range(page_num, run_end), old_gap):
+                matches[new_num] = old_num
+                used.add(old_num)
+        else:
+            unsure.extend(range(page_num, run_end))
+        page_num = run_end
+
+    if unsure and old_tiles is not None and new_tiles is not None:
+        pairs = sorted(
+            ((_tile_overlap(old_tiles[o], new_tiles[n]), -abs(o - n), n, o)
+             for n in unsure for o in range(len(old_pages)) if o not in used),
+            reverse=True,
+        )
+        for score, _, new_num, old_num in pairs:
+            if score * 2 <= len(new_tiles[new_num]):
+                break
+            if new_num in matches or old_num in used:
+                continue
+            matches[new_num] = old_num
+            used.add(old_num)
+    return matches
+
+
+def diff_pages(old_pages, new_pages, matches=None):
+    """Compare page fingerprints of two revisions.
+
+    Page numbers in "changed", "unchanged" and "added" refer to the new
+    revision, "removed" to the old one; "moved" lists [old, new] pairs of
+    pages whose position changed.
+    """
+    if matches is None:
+        matches = match_pages(old_pages, new_pages)
+    summary = {"changed": [], "unchanged": [], "added": [], "removed": [], "moved": []}
+    for page_num, fingerprint in enumerate(new_pages):
+        old_num = matches.get(page_num)
+        if old_num is None:
+            summary["added"].append(page_num)
+            continue
+        if old_pages[old_num] == fingerprint:
+            summary["unchanged"].append(page_num)
+        else:
+            summary["changed"].append(page_num)
+        if old_num != page_num:
+            summary["moved"].append([old_num, page_num])
+    matched = set(matches.values())
+    summary["removed"] = [n for n in range(len(old_pages)) if n not in matched]
+    return summary
+
+
+async def apply_revision(project_id, doc):
+    """Register `doc` as the next revision of the project.
+
+    Old pages are matched to new ones by fingerprint first (see
+    match_pages). Takeoffs on unchanged pages carry over as-is, moved to
+    the page's new number. On changed pages each takeoff's region is
+    fingerprinted again; if that region did not change it carries over
+    too, otherwise it is returned as stale. Takeoffs on pages with no
+    match in the new revision are returned as removed.
+
+    Yields to the event loop between pages while fingerprinting; the
+    project itself is read and updated only after that, in one step.
+    """
+    signatures = []
+    for page in doc:
+        signatures.append(page_signature(page))
+        await asyncio.sleep(0)
+    new_pages = [fingerprint for fingerprint, _ in signatures]
+    new_tiles = [tiles for _, tiles in signatures]
+    previous = projects.get(project_id)
+    if previous is None:
+        projects[project_id] = {"revision": 1, "pages": new_pages, "tiles": new_tiles, "takeoffs": {}}
+        summary = diff_pages([], new_pages)
+        return projects[project_id], summary, [], []
+
+    matches = match_pages(previous["pages"], new_pages, previous["tiles"], new_tiles)
+    summary = diff_pages(previous["pages"], new_pages, matches)
+    new_page_of = {old_num: page_num for page_num, old_num in matches.items()}
+    unchanged = set(summary["unchanged"])
+    takeoffs = {}
+    stale = []
+    removed = []
+    for takeoff in previous["takeoffs"].values():
+        page_num = new_page_of.get(takeoff["page_num"])
+        if page_num is None:
+            removed.append(takeoff)
+            continue
+        takeoff = dict(takeoff, page_num=page_num)
+        if page_num in unchanged:
+            takeoffs[takeoff_key(page_num, takeoff["rect"])] = takeoff
+        elif fingerprint_region(doc[page_num], takeoff["rect"]) == takeoff["fingerprint"]:
+            takeoffs[takeoff_key(page_num, takeoff["rect"])] = takeoff
+        else:
+            stale.append(takeoff)
+
+    projects[project_id] = {
+        "revision": previous["revision"] + 1,
+        "pages": new_pages,
+        "tiles": new_tiles,
+        "takeoffs": takeoffs,
+    }
+    return projects[project_id], summary, stale, removed
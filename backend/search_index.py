@@ -0,0 +1,95 @@
+import re
+import hashlib
+from collections import OrderedDict
+import fitz  # PyMuPDF
+
+from extraction import OCR_ZOOM, normalize_text
+
+# Max number of documents whose index is kept in memory
+INDEX_CACHE_SIZE = 20
+
+# doc_id -> {"page_count": int, "terms": {term: [entry, ...]}, "seen": set()}
+documents = OrderedDict()
+
+
+def document_id(pdf_bytes):
+    return hashlib.sha1(pdf_bytes).hexdigest()
+
+
+def normalize_term(text):
+    """Normalize a word the same way the extractor reads OCR text."""
+    term = re.sub(r'\s+', '', normalize_text(text.strip()))
+    return term.strip('.,;:').upper()
+
+
+def _add(index, term, page_num, rect, text, source):
+    if not term:
+        return
+    # OCR passes and the text layer often report the same word; keep one
+    key = (term, page_num, round((rect.x0 + rect.x1) / 2), round((rect.y0 + rect.y1) / 2))
+    if key in index["seen"]:
+        return
+    index["seen"].add(key)
+    index["terms"].setdefault(term, []).append({
+        "page_num": page_num,
+        "bbox": [rect.x0, rect.y0, rect.x1, rect.y1],
+        "text": text,
+        "source": source,
+    })
+
+
+def build_index(doc_id, doc):
+    """Index every word of the PDF text layer, once per document."""
+    index = documents.get(doc_id)
+    if index is not None:
+        documents.move_to_end(doc_id)
+        return index, False
+
+    index = {"page_count": len(doc), "terms": {}, "seen": set()}
+    for page in doc:
+        # Words come back unrotated; bring them into the page.rect space
+        # the extraction endpoints take their regions in
+        rot = page.rotation_matrix
+        for w in page.get_text("words"):
+            _add(index, normalize_term(w[4]), page.number, fitz.Rect(w[:4]) * rot, w[4], "text")
+
+    documents[doc_id] = index
+    while len(documents) > INDEX_CACHE_SIZE:
+        documents.popitem(last=False)
+    return index, True
+
+
+def add_ocr_tokens(doc_id, page_num, rect, tokens):
+    """Merge OCR tokens of one extracted region into an existing index."""
+    index = documents.get(doc_id)
+    if index is None:
+        return
+    for (bbox, text_val, conf) in tokens:
+        xs = [p[0] for p in bbox]
+        ys = [p[1] for p in bbox]
+        # Tokens are in crop pixels at OCR zoom
+        token_rect = fitz.Rect(
+            rect.x0 + min(xs) / OCR_ZOOM, rect.y0 + min(ys) / OCR_ZOOM,
+            rect.x0 + max(xs) / OCR_ZOOM, rect.y0 + max(ys) / OCR_ZOOM,
+        )
+        _add(index, normalize_term(text_val), page_num, token_rect, text_val, "ocr")
+
+
+def search(doc_id, query):
+    """Find every indexed word containing `query` as a whole token.
+
+    `W14x22` matches `W14X22` and `W14X22[12]` but not `W14X223`.
+    Returns None if the document has not been indexed.
+    """
+    index = documents.get(doc_id)
+    if index is None:
+        return None
+    term = normalize_term(query)
+    matches = []
+    if term:
+        pattern = re.compile(r'(?<![A-Z0-9])' + re.escape(term) + r'(?![A-Z0-9])')
+        for indexed_term, entries in index["terms"].items():
+            if term in indexed_term and pattern.search(indexed_term):
+                matches.extend(entries)
+    matches.sort(key=lambda m: (m["page_num"], m["bbox"][1], m["bbox"][0]))
+    return term, matches
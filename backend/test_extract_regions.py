@@ -0,0 +1,42 @@
+import requests
+import json
+import time
+
+url = "http://localhost:5001/api/extract-regions"
+
+# A few boxes on the same sheet, as an estimator would mark them
+regions = [
+    {'x': 0, 'y': 0, 'width': 300, 'height': 400},
+    {'x': 300, 'y': 0, 'width': 300, 'height': 400},
+    {'x': 0, 'y': 400, 'width': 600, 'height': 400},
+]
+
+files = {
+    'pdf': ('test_valid.pdf', open('test_valid.pdf', 'rb'), 'application/pdf')
+}
+data = {
+    'regions': json.dumps(regions),
+    'page_num': 0
+}
+
+try:
+    print(f"Sending {len(regions)} regions to {url}...")
+    start_time = time.time()
+    response = requests.post(url, files=files, data=data)
+    print(f"Status Code: {response.status_code} ({time.time() - start_time:.2f}s)")
+
+    if response.status_code == 200:
+        res_json = response.json()
+        if len(res_json.get('regions', [])) == len(regions):
+            print("✅ One result per region.")
+        else:
+            print(f"❌ Expected {len(regions)} region results, got {len(res_json.get('regions', []))}")
+        for i, region in enumerate(res_json.get('regions', [])):
+            print(f"  Region {i}: {region['profiles']} (count {region['studs_count']})")
+        print("Combined profiles:", json.dumps(res_json.get('profiles'), indent=2))
+        print(f"Combined total: {res_json.get('studs_total')} / count {res_json.get('studs_count')}")
+    else:
+        print(f"Error Response: {response.text}")
+
+except Exception as e:
+    print(f"Error: {e}")
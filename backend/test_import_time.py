@@ -0,0 +1,105 @@
+"""Import-time budget for each API role.
+
+Imports main.py under `python -X importtime` once per API_ROLE and checks
+that the role stays within its budget and does not pull in modules it
+never uses (render replicas must not load numpy, OpenCV or EasyOCR).
+
+Budgets are time on top of importing fastapi and fitz, which every role
+needs, so the check holds on slow and fast machines alike. Each run imports
+the baseline and main back to back and the budget applies to the median
+difference, which keeps single noisy runs from failing the check.
+
+    python test_import_time.py
+    python -m pytest test_import_time.py
+"""
+import os
+import subprocess
+import sys
+
+# Allowed import time of `main` beyond the fastapi + fitz baseline (ms).
+# Run-to-run noise is around ±150 ms; the forbidden-module check below is
+# what catches a heavy import slipping into the render role.
+BUDGET_MS = {
+    "render": 300,
+    "ocr": 800,
+    "all": 800,
+}
+FORBIDDEN = {
+    "render": ["numpy", "cv2", "PIL", "easyocr", "torch"],
+    "ocr": ["easyocr", "torch"],
+    "all": ["easyocr", "torch"],
+}
+RUNS = 7
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(code, role="all"):
+    """Run `code` under -X importtime.
+
+    Returns (ms spent in top-level imports, set of imported top-level modules).
+    """
+    env = dict(os.environ, API_ROLE=role)
+    env.pop("OCR_PRELOAD", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{code!r} failed for role {role}:\n{proc.stderr}")
+
+    total_us = 0
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        modules.add(name.strip().split(".")[0])
+        # Unindented names are imported directly by `code`; site runs before it
+        if not name.startswith("  ") and name.strip() != "site":
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def median_overhead(role):
+    """Median of (main - baseline) over RUNS paired runs, plus main's modules."""
+    extras = []
+    modules = set()
+    for _ in range(RUNS):
+        baseline_ms, _ = measure("import fastapi, fitz", role)
+        total_ms, run_modules = measure("import main", role)
+        extras.append(total_ms - baseline_ms)
+        modules |= run_modules
+    extras.sort()
+    return extras[len(extras) // 2], modules
+
+
+def check_import_time():
+    """Return a list of budget or forbidden-import failures for all roles."""
+    failures = []
+    for role in BUDGET_MS:
+        extra_ms, modules = median_overhead(role)
+
+        loaded = [m for m in FORBIDDEN[role] if m in modules]
+        status = "✅" if extra_ms <= BUDGET_MS[role] and not loaded else "❌"
+        print(f"{status} {role:<7} {extra_ms:+5.0f} ms over baseline (budget +{BUDGET_MS[role]} ms)")
+        if extra_ms > BUDGET_MS[role]:
+            failures.append(f"{role}: +{extra_ms:.0f} ms over budget of +{BUDGET_MS[role]} ms")
+        if loaded:
+            failures.append(f"{role}: imports {', '.join(loaded)}")
+    return failures
+
+
+def test_import_time():
+    failures = check_import_time()
+    assert not failures, "; ".join(failures)
+
+
+if __name__ == "__main__":
+    failures = check_import_time()
+    if failures:
+        print("\n".join(f"❌ {f}" for f in failures))
+        sys.exit(1)
+    print("✅ All roles within budget")
@@ -0,0 +1,118 @@
+"""Offline checks for revision page matching (no server, no OCR).
+
+    python test_revisions.py
+"""
+import asyncio
+import fitz  # PyMuPDF
+
+import revisions
+from revisions import match_pages, diff_pages, apply_revision, record_takeoff, fingerprint_region
+
+
+def tiles(*pages):
+    # One tile hash per character, so "cccx" shares 3 of 4 tiles with "cccc"
+    return [list(p) for p in pages]
+
+
+def test_insert_at_front():
+    old, new = list("ABCD"), list("XABCD")
+    assert match_pages(old, new) == {1: 0, 2: 1, 3: 2, 4: 3}
+    summary = diff_pages(old, new)
+    assert summary["added"] == [0]
+    assert summary["unchanged"] == [1, 2, 3, 4]
+    assert summary["removed"] == []
+
+
+def test_delete():
+    old, new = list("ABCD"), list("ACD")
+    assert match_pages(old, new) == {0: 0, 1: 2, 2: 3}
+    summary = diff_pages(old, new)
+    assert summary["removed"] == [1]
+    assert summary["moved"] == [[2, 1], [3, 2]]
+
+
+def test_swap():
+    old, new = list("ABCD"), list("ABDC")
+    assert match_pages(old, new) == {0: 0, 1: 1, 2: 3, 3: 2}
+    summary = diff_pages(old, new)
+    assert summary["unchanged"] == [0, 1, 2, 3]
+    assert summary["moved"] == [[3, 2], [2, 3]]
+
+
+def test_duplicate_blank_pages():
+    old, new = ["A", "blank", "blank", "B"], ["A", "blank", "B"]
+    assert match_pages(old, new) == {0: 0, 1: 1, 2: 3}
+    assert diff_pages(old, new)["removed"] == [2]
+
+
+def test_revise_in_place():
+    old, new = list("ABCD"), ["A", "B'", "C", "D"]
+    assert match_pages(old, new) == {0: 0, 1: 1, 2: 2, 3: 3}
+    assert diff_pages(old, new)["changed"] == [1]
+
+
+def test_delete_and_revise():
+    # B deleted, C revised: C' must pair with C, not with B
+    old, new = list("ABCD"), ["A", "C'", "D"]
+    old_tiles = tiles("aaaa", "bbbb", "cccc", "dddd")
+    new_tiles = tiles("aaaa", "cccx", "dddd")
+    matches = match_pages(old, new, old_tiles, new_tiles)
+    assert matches == {0: 0, 1: 2, 2: 3}
+    summary = diff_pages(old, new, matches)
+    assert summary["changed"] == [1]
+    assert summary["removed"] == [1]
+
+
+def test_unrelated_page_is_added():
+    # Shares only the title block tile with the deleted sheets
+    old, new = list("ABCD"), ["A", "X", "D"]
+    matches = match_pages(old, new, tiles("aaaa", "bbbt", "ccct", "dddd"), tiles("aaaa", "xxxt", "dddd"))
+    assert matches == {0: 0, 2: 3}
+    summary = diff_pages(old, new, matches)
+    assert summary["added"] == [1]
+    assert summary["removed"] == [1, 2]
+
+
+def make_set(sheets):
+    # Each sheet has its own content all over the page; a revision note
+    # changes one spot of it
+    doc = fitz.open()
+    for sheet, note in sheets:
+        page = doc.new_page()
+        page.insert_text((50, 50), "TITLE BLOCK")
+        for row in range(4):
+            for col in range(4):
+                page.insert_text((20 + col * 150, 150 + row * 180), f"S{sheet} DETAIL {row}{col}", fontsize=14)
+        if note:
+            page.insert_text((50, 520), note)
+    return doc
+
+
+def test_apply_revision_delete_and_revise():
+    project_id = "test-delete-and-revise"
+    revisions.projects.pop(project_id, None)
+    top, bottom = fitz.Rect(0, 0, 200, 100), fitz.Rect(0, 450, 200, 550)
+
+    doc_a = make_set([(1, ""), (2, ""), (3, ""), (4, "")])
+    asyncio.run(apply_revision(project_id, doc_a))
+    for page in doc_a:
+        for rect in (top, bottom):
+            record_takeoff(project_id, page.number, rect, fingerprint_region(page, rect), {"page": page.number})
+
+    doc_b = make_set([(1, ""), (3, "REV 1"), (4, "")])
+    project, summary, stale, removed = asyncio.run(apply_revision(project_id, doc_b))
+    assert summary["changed"] == [1]
+    assert summary["removed"] == [1]
+    # Sheet 2's takeoffs are reported, sheet 3's follow it to page 1
+    assert sorted(t["result"]["page"] for t in removed) == [1, 1]
+    assert [(t["page_num"], t["rect"][1], t["result"]["page"]) for t in stale] == [(1, 450.0, 2)]
+    carried = sorted((t["page_num"], t["rect"][1], t["result"]["page"]) for t in project["takeoffs"].values())
+    assert carried == [(0, 0.0, 0), (0, 450.0, 0), (1, 0.0, 2), (2, 0.0, 3), (2, 450.0, 3)]
+    assert project["revision"] == 2
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -16,7 +16,7 @@ export const renderPage = async (file, pageNum = 0, zoom = 2.0) => {
     return URL.createObjectURL(response.data);
 };
 
-export const extractText = async (file, region, pageNum = 0) => {
+export const extractText = async (file, region, pageNum = 0, options = {}) => {
     const formData = new FormData();
     formData.append('pdf', file);
     formData.append('x', region.x);
@@ -24,8 +24,55 @@ export const extractText = async (file, region, pageNum = 0) => {
     formData.append('width', region.width);
     formData.append('height', region.height);
     formData.append('page_num', pageNum);
+    // Optional cancellation: jobId for cancelJob(), sessionId + supersede to
+    // cancel this session's previous extraction
+    if (options.jobId) formData.append('job_id', options.jobId);
+    if (options.sessionId) formData.append('session_id', options.sessionId);
+    if (options.supersede) formData.append('supersede', true);
 
-    const response = await api.post('/api/extract-text', formData);
+    const response = await api.post('/api/extract-text', formData, {
+        signal: options.signal,
+    });
+    return response.data;
+};
+
+export const cancelJob = async (jobId) => {
+    const response = await api.post(`/api/jobs/${jobId}/cancel`);
+    return response.data;
+};
+
+export const extractRegions = async (file, regions, pageNum = 0) => {
+    const formData = new FormData();
+    formData.append('pdf', file);
+    formData.append('regions', JSON.stringify(regions));
+    formData.append('page_num', pageNum);
+
+    const response = await api.post('/api/extract-regions', formData);
+    return response.data;
+};
+
+export const uploadRevision = async (file, projectId, reextract = false) => {
+    const formData = new FormData();
+    formData.append('pdf', file);
+    formData.append('project_id', projectId);
+    formData.append('reextract', reextract);
+
+    const response = await api.post('/api/upload-revision', formData);
+    return response.data;
+};
+
+export const indexDocument = async (file) => {
+    const formData = new FormData();
+    formData.append('pdf', file);
+
+    const response = await api.post('/api/index-document', formData);
+    return response.data;
+};
+
+export const searchDocument = async (docId, query, limit = 500) => {
+    const response = await api.get('/api/search', {
+        params: { doc_id: docId, q: query, limit },
+    });
     return response.data;
 };
 